@@ -1,66 +1,178 @@
+import array
 import asyncio
 import struct
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from scipy.signal import find_peaks
-from bleak import BleakClient, BleakScanner
+import bottleneck as bn
+from numba import njit
+from bleak import BleakClient
+
+from src.utils.ble_scanner import find_device
 
 # UUIDs
 ECG_UUID = "FB005C04-02E7-F387-1CAD-8ACD2D8DF0C8"
 HR_UUID  = "00002A37-0000-1000-8000-00805f9b34fb"
 
-# Buffers
-ecg_data = []       
-polar_hr_data = []  
-computed_hr_data = []  
-
 # ECG processing parameters
 ECG_FS = 130  # Hz sampling rate
 WINDOW_SEC = 10  # compute HR from last 10s of ECG
+ECG_WINDOW = ECG_FS * WINDOW_SEC
+NS_PER_SEC = 1_000_000_000  # timestamps are integer nanoseconds from time.time_ns()
+MIN_PEAK_DIST = ECG_FS // 2
+THRESHOLD_WINDOW = ECG_FS  # samples in the rolling window behind each R-peak threshold
+
+# Buffers
+ecg_ts = np.empty(ECG_WINDOW * 2, dtype=np.int64)      # ring of packet timestamps (ns)
+ecg_signal = np.empty(ECG_WINDOW * 2, dtype=np.int16)  # ring of raw ADC samples
+ecg_scratch = np.empty_like(ecg_signal)  # reused when a read wraps around the ring
+ecg_idx = 0         # next write position in the rings
+ecg_count = 0       # total samples received
+ecg_chunks = []     # (timestamp, samples) per packet, kept for save_data
+ecg_scanned = 0     # samples before this index have been searched for peaks
+peak_deque = deque()  # (timestamp, sample index) of R-peaks within the window
+# Single worker: packet parsing and HR computation run in order, off the event loop
+ecg_pool = ThreadPoolExecutor(max_workers=1)
+polar_hr_ts = array.array('q')    # Polar-reported HR timestamps (ns)
+polar_hr_vals = array.array('H')  # Polar-reported HR values (integer bpm)
+computed_hr_ts = array.array('q')    # ECG-derived HR timestamps (ns)
+computed_hr_vals = array.array('d')  # ECG-derived HR values
+
+@njit(cache=True, fastmath=True, nogil=True)
+def detect_rpeaks(signal, min_dist, heights):
+    """Return indices of samples >= their heights entry that are the maximum within min_dist samples either side."""
+    n = len(signal)
+    peaks = np.empty(n, dtype=np.int64)
+    count = 0
+    i = 1
+    while i < n - 1:
+        value = signal[i]
+        is_peak = value >= heights[i]
+        if is_peak:
+            # Strict on the left, so the first sample of a plateau wins
+            for j in range(max(0, i - min_dist + 1), i):
+                if signal[j] >= value:
+                    is_peak = False
+                    break
+        if is_peak:
+            for j in range(i + 1, min(n, i + min_dist)):
+                if signal[j] > value:
+                    is_peak = False
+                    break
+        if is_peak:
+            peaks[count] = i
+            count += 1
+            # Nothing within min_dist after a peak can be another peak
+            i += min_dist
+        else:
+            i += 1
+    return peaks[:count]
+
+# Compile up front so the first HR computation doesn't pay for JIT
+detect_rpeaks(np.zeros(ECG_WINDOW, dtype=np.int16), MIN_PEAK_DIST, np.zeros(ECG_WINDOW))
+
+def ring_signal(start, stop, out=None):
+    """Return ECG samples with absolute indices [start, stop) from the ring buffer.
+
+    Contiguous ranges are returned as views. Wrapped ranges are copied into
+    out when given, otherwise into a new array.
+    """
+    size = len(ecg_signal)
+    first = start % size
+    last = first + (stop - start)
+    if last <= size:
+        return ecg_signal[first:last]
+    # Range wraps around the end of the ring
+    if out is None:
+        return np.concatenate((ecg_signal[first:], ecg_signal[:last - size]))
+    head = size - first
+    out[:head] = ecg_signal[first:]
+    out[head:stop - start] = ecg_signal[:last - size]
+    return out[:stop - start]
 
 async def find_polar():
     """Scan and return the address of the first Polar H10 found."""
     print("🔍 Scanning for Polar H10...")
-    devices = await BleakScanner.discover(timeout=5.0)
-    for d in devices:
-        if d.name and "Polar H10" in d.name:
-            print(f"✅ Found Polar H10: {d.name} ({d.address})")
-            return d.address
+    d = await find_device("Polar H10", timeout=5.0)
+    if d:
+        print(f"✅ Found Polar H10: {d.name} ({d.address})")
+        return d.address
     raise RuntimeError("No Polar H10 found nearby!")
 
 def ecg_handler(sender, data: bytearray):
-    """Handle incoming ECG packets."""
-    timestamp = time.time()
-    for i in range(3, len(data), 2):
-        sample = struct.unpack_from("<h", data, i)[0]
-        ecg_data.append((timestamp, sample))
+    """Handle incoming ECG packets by handing them to the ECG worker thread."""
+    future = ecg_pool.submit(process_ecg_packet, bytes(data), time.time_ns())
+    future.add_done_callback(report_worker_error)
+
+def report_worker_error(future):
+    """Print exceptions raised on the ECG worker, which would otherwise be lost."""
+    if not future.cancelled() and future.exception():
+        print(f"[ERROR] ECG packet processing failed: {future.exception()}")
+
+def process_ecg_packet(data: bytes, timestamp: int):
+    """Parse an ECG packet into the ring buffer."""
+    global ecg_idx, ecg_count
+    if len(data) < 3:
+        return
+    samples = np.frombuffer(data, dtype="<i2", count=(len(data) - 3) // 2, offset=3)
+    ecg_chunks.append((timestamp, samples))
+
+    n = len(samples)
+    size = len(ecg_signal)
+    first = min(n, size - ecg_idx)
+    ecg_ts[ecg_idx:ecg_idx + first] = timestamp
+    ecg_signal[ecg_idx:ecg_idx + first] = samples[:first]
+    if first < n:
+        ecg_ts[:n - first] = timestamp
+        ecg_signal[:n - first] = samples[first:]
+    ecg_idx = (ecg_idx + n) % size
+    ecg_count += n
 
 def hr_handler(sender, data: bytearray):
     """Handle incoming HR packets (standard BLE HR characteristic)."""
-    timestamp = time.time()
+    timestamp = time.time_ns()
     flags = data[0]
     hr_format = flags & 0x01  
     if hr_format == 0:
         hr = data[1]
     else:
         hr = struct.unpack_from("<H", data, 1)[0]
-    polar_hr_data.append((timestamp, hr))
+    polar_hr_ts.append(timestamp)
+    polar_hr_vals.append(hr)
 
 def compute_hr_from_ecg():
-    """Compute HR from ECG using simple R-peak detection."""
-    if len(ecg_data) < ECG_FS * WINDOW_SEC:
+    """Compute HR from ECG by searching only the samples that arrived since the last call."""
+    global ecg_scanned
+    count = ecg_count
+    if count < ECG_WINDOW:
         return None
-    recent = ecg_data[-ECG_FS*WINDOW_SEC:]
-    signal = np.array([s for _, s in recent])
-    threshold = np.mean(signal) + 0.5*np.std(signal)
-    peaks, _ = find_peaks(signal, distance=ECG_FS//2, height=threshold)
-    if len(peaks) < 2:
+    # A candidate needs MIN_PEAK_DIST samples of context on both sides,
+    # and a full THRESHOLD_WINDOW behind it for its threshold
+    scan_from = max(ecg_scanned, count - ECG_WINDOW)
+    scan_to = count - MIN_PEAK_DIST + 1
+    offset = max(scan_from - max(MIN_PEAK_DIST, THRESHOLD_WINDOW - 1), 0)
+    signal = ring_signal(offset, count, out=ecg_scratch)
+    # Per-sample threshold from a rolling window follows baseline drift.
+    # bottleneck only has fast paths for 32/64-bit types, hence the float copy.
+    values = signal.astype(np.float64)
+    heights = (bn.move_mean(values, THRESHOLD_WINDOW, min_count=1)
+               + 0.5*bn.move_std(values, THRESHOLD_WINDOW, min_count=1))
+    peaks = detect_rpeaks(signal, MIN_PEAK_DIST, heights) + offset
+    size = len(ecg_signal)
+    for peak in peaks[(peaks >= scan_from) & (peaks < scan_to)]:
+        peak_deque.append((ecg_ts[peak % size], peak))
+    ecg_scanned = scan_to
+
+    while peak_deque and peak_deque[0][1] < count - ECG_WINDOW:
+        peak_deque.popleft()
+    if len(peak_deque) < 2:
         return None
-    rr_intervals = np.diff(peaks) / ECG_FS
-    hr = 60.0 / np.mean(rr_intervals)
-    timestamp = recent[-1][0]
-    computed_hr_data.append((timestamp, hr))
+    hr = 60.0 * ECG_FS * (len(peak_deque) - 1) / (peak_deque[-1][1] - peak_deque[0][1])
+    timestamp = ecg_ts[(count - 1) % size]
+    computed_hr_ts.append(timestamp)
+    computed_hr_vals.append(hr)
     return hr
 
 async def run_client():
@@ -73,9 +185,10 @@ async def run_client():
         await client.start_notify(HR_UUID, hr_handler)
 
         print("📡 Streaming... Press Ctrl+C to stop.")
+        loop = asyncio.get_running_loop()
         try:
             while True:
-                hr_ecg = compute_hr_from_ecg()
+                hr_ecg = await loop.run_in_executor(ecg_pool, compute_hr_from_ecg)
                 if hr_ecg:
                     print(f"Computed HR (from ECG): {hr_ecg:.1f} bpm")
                 await asyncio.sleep(1)
@@ -85,11 +198,35 @@ async def run_client():
         await client.stop_notify(ECG_UUID)
         await client.stop_notify(HR_UUID)
 
+def nearest_indices(t_left, t_right, tolerance):
+    """For each sorted t_left, return the index of the nearest sorted t_right and whether it is within tolerance.
+
+    Like merge_asof(direction='nearest'), ties go to the earlier side and the last of duplicate t_right values.
+    """
+    before = np.clip(np.searchsorted(t_right, t_left, side='right') - 1, 0, len(t_right) - 1)
+    after = np.clip(np.searchsorted(t_right, t_left, side='left'), 0, len(t_right) - 1)
+    nearest = np.where(t_left - t_right[before] <= t_right[after] - t_left, before, after)
+    matched = np.abs(t_right[nearest] - t_left) <= tolerance
+    return nearest, matched
+
 def save_data():
     """Save all collected data to CSVs."""
-    df_ecg = pd.DataFrame(ecg_data, columns=["timestamp", "ecg_uV"])
-    df_hr = pd.DataFrame(polar_hr_data, columns=["timestamp", "polar_hr_bpm"])
-    df_computed = pd.DataFrame(computed_hr_data, columns=["timestamp", "ecg_hr_bpm"])
+    ecg_pool.shutdown(wait=True)  # let queued packets reach the buffers first
+    if ecg_chunks:
+        df_ecg = pd.DataFrame({
+            "timestamp": np.repeat(np.array([t for t, _ in ecg_chunks], dtype=np.int64), [len(s) for _, s in ecg_chunks]),
+            "ecg_uV": np.concatenate([s for _, s in ecg_chunks]),
+        })
+    else:
+        df_ecg = pd.DataFrame(columns=["timestamp", "ecg_uV"])
+    df_hr = pd.DataFrame({
+        "timestamp": np.frombuffer(polar_hr_ts, dtype=np.int64),
+        "polar_hr_bpm": np.frombuffer(polar_hr_vals, dtype=np.uint16),
+    })
+    df_computed = pd.DataFrame({
+        "timestamp": np.frombuffer(computed_hr_ts, dtype=np.int64),
+        "ecg_hr_bpm": np.frombuffer(computed_hr_vals, dtype=np.float64),
+    })
 
     df_ecg.to_csv("polar_ecg.csv", index=False)
     df_hr.to_csv("polar_hr.csv", index=False)
@@ -97,13 +234,15 @@ def save_data():
 
     # Merge HR streams for comparison
     if not df_hr.empty and not df_computed.empty:
-        df_hr_combined = pd.merge_asof(
-            df_hr.sort_values("timestamp"),
-            df_computed.sort_values("timestamp"),
-            on="timestamp",
-            direction="nearest",
-            tolerance=1
+        df_hr_combined = df_hr.sort_values("timestamp", ignore_index=True)
+        df_computed = df_computed.sort_values("timestamp", ignore_index=True)
+        nearest, matched = nearest_indices(
+            df_hr_combined["timestamp"].to_numpy(),
+            df_computed["timestamp"].to_numpy(),
+            tolerance=NS_PER_SEC
         )
+        ecg_hr = df_computed["ecg_hr_bpm"].to_numpy(dtype=np.float64)[nearest]
+        df_hr_combined["ecg_hr_bpm"] = np.where(matched, ecg_hr, np.nan)
         df_hr_combined.to_csv("polar_hr_comparison.csv", index=False)
         print("Saved combined HR -> polar_hr_comparison.csv")
 
@@ -1,13 +1,12 @@
 import asyncio
-from bleak import BleakScanner
+from src.utils.ble_scanner import find_device
 
 async def find_polar():
     print("Scanning for Polar H10...")
-    devices = await BleakScanner.discover(timeout=5.0)
-    for d in devices:
-        if d.name and "Polar H10" in d.name:
-            print(f"Found Polar H10: {d.name} ({d.address})")
-            return d.address
+    d = await find_device("Polar H10", timeout=5.0)
+    if d:
+        print(f"Found Polar H10: {d.name} ({d.address})")
+        return d.address
     raise RuntimeError("No Polar H10 found nearby!")
 
 if __name__ == "__main__":
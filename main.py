@@ -9,6 +9,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
 from src.acquisition.live_hub_controller import LiveHubController
 from src.utils.file_manager import create_session_paths
+from src.utils.plot_utils import decimate_series
 import pandas as pd
 
 # --- Backend Process ---
@@ -98,6 +99,7 @@ def run_ui(to_ui_q, from_ui_q, session_path_q):
             dpg.add_line_series([], [], label="HR", parent="y_axis_hr", tag="hr_series")
 
     def update_ui_loop(sender, app_data, user_data):
+        latest_hr_data = None
         while not to_ui_q.empty():
             data = to_ui_q.get()
             print(f"[DEBUG] UI received: {data}")
@@ -127,14 +129,21 @@ def run_ui(to_ui_q, from_ui_q, session_path_q):
                         dpg.bind_item_theme("backend_status", red_theme)
             
             elif data.get('type') == 'hr_data':
-                hr_data.clear() # Clear any old data
-                hr_data.extend(data['hr_data'])
-                
-                x_data = list(range(len(hr_data)))
-                dpg.set_value("hr_series", [x_data, hr_data])
+                # Each message carries the full series, so only the newest one is plotted
+                latest_hr_data = data['hr_data']
+
+        if latest_hr_data is not None:
+            length_changed = len(latest_hr_data) != len(hr_data)
+            hr_data.clear() # Clear any old data
+            hr_data.extend(latest_hr_data)
+            
+            dpg.set_value("hr_series", list(decimate_series(hr_data)))
+            if length_changed:
                 dpg.set_axis_limits("x_axis_hr", 0, len(hr_data))
-                dpg.fit_axis_data("y_axis_hr")
-                print(f"[DEBUG] Plot updated with {len(hr_data)} data points.")
+                # Refitting every frame is wasted work for a slowly growing series
+                if len(hr_data) % 16 == 0:
+                    dpg.fit_axis_data("y_axis_hr")
+            print(f"[DEBUG] Plot updated with {len(hr_data)} data points.")
         
         dpg.set_frame_callback(dpg.get_frame_count() + 1, update_ui_loop)
     
@@ -1,4 +1,7 @@
-import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import os
 
 # Define the input and output file paths
@@ -11,17 +14,26 @@ if not os.path.exists(output_dir):
     os.makedirs(output_dir, exist_ok=True)
     print(f"Created directory: {output_dir}")
 
-# Read the parquet file into a pandas DataFrame
+# Read the parquet file into an Arrow table
 try:
-    df = pd.read_parquet(input_parquet_file)
+    table = pq.read_table(input_parquet_file)
     print("Parquet file loaded successfully.")
 
-    # Convert the rr_ms_list column to a string representation
-    df['rr_ms_list'] = df['rr_ms_list'].astype(str)
+    # CSV has no list type, so render rr_ms_list as e.g. "[839 858]" with Arrow compute kernels
+    rr_index = table.schema.get_field_index('rr_ms_list')
+    rr_strings = pc.binary_join(pc.cast(table['rr_ms_list'], pa.list_(pa.string())), ' ')
+    rr_strings = pc.binary_join_element_wise('[', rr_strings, ']', '')
+    table = table.set_column(rr_index, 'rr_ms_list', rr_strings)
 
-    # Convert the DataFrame to a CSV file
-    df.to_csv(output_csv_file, index=False)
+    # Raw packet bytes aren't valid UTF-8, so hex-encode binary columns as the old raw_hex CSVs did
+    for i, field in enumerate(table.schema):
+        if pa.types.is_binary(field.type):
+            hex_strings = [b.hex() if b is not None else None for b in table.column(i).to_pylist()]
+            table = table.set_column(i, field.name, pa.array(hex_strings, pa.string()))
+
+    # Stream the table to a CSV file
+    pacsv.write_csv(table, output_csv_file, write_options=pacsv.WriteOptions(include_header=True))
     print(f"Data successfully converted and saved to {output_csv_file}")
 
 except Exception as e:
-    print(f"An error occurred: {e}")
\ No newline at end of file
+    print(f"An error occurred: {e}")
@@ -1,15 +1,31 @@
+import array
 import asyncio
+import threading
 import time
-import struct
+import numpy as np
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from bleak import BleakClient, BleakScanner, BleakError
+from bleak import BleakClient, BleakError
 import os
 
+from src.utils.ble_scanner import find_device
+from src.utils.file_manager import load_known_address, save_known_address
+
 HR_CHARACTERISTIC_UUID = "00002a37-0000-1000-8000-00805f9b34fb"
 
+SCHEMA = pa.schema([
+    ('t_sys', pa.int64()),  # time.perf_counter_ns()
+    ('t_utc', pa.timestamp('us')),
+    ('hr_bpm', pa.uint8()),
+    ('rr_ms_list', pa.list_(pa.uint16())),
+])
+# Raw packet bytes are only logged when HUB_KEEP_RAW=1
+RAW_SCHEMA = SCHEMA.append(pa.field('raw_hex', pa.binary()))
+LOG_BATCH_SIZE = 64  # records buffered before a batch is written to Parquet
+
 class LiveHubController:
     def __init__(self, to_ui_q, from_ui_q, session_path_q):
         self.to_ui_q = to_ui_q
@@ -18,10 +34,16 @@ class LiveHubController:
 
         self.client = None
         self.connected_address = None
-        self.notification_queue = asyncio.Queue()
         self.session_active = False
         self.session_path = None
-        self.data_log = []
+        self._reset_log()
+        self.writer = None
+        self.rows_written = 0
+        self.keep_raw = os.getenv('HUB_KEEP_RAW') == '1'
+        self.schema = RAW_SCHEMA if self.keep_raw else SCHEMA
+        # Packets are parsed and logged on one worker thread so the event loop never stalls
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        self._log_lock = threading.Lock()
         
         self.command_handler = {
             'connect_and_start': self.connect_and_start_session,
@@ -30,15 +52,28 @@ class LiveHubController:
             'load_file': self.load_file_and_send_to_ui
         }
         
-    async def _find_polar_h10(self, device_name="Polar H10"):
+    async def _find_polar_h10(self, device_name="Polar H10", timeout=5.0):
         print(f"[DEBUG] Scanning for {device_name}...")
-        devices = await BleakScanner.discover()
-        for d in devices:
-            if d.name and device_name in d.name:
-                print(f"[DEBUG] Found {device_name} at address: {d.address}")
-                return d.address
-        print(f"[DEBUG] Could not find {device_name}.")
-        return None
+        device = await find_device(device_name, timeout=timeout)
+        if not device:
+            print(f"[DEBUG] Could not find {device_name}.")
+            return None
+        print(f"[DEBUG] Found {device_name} at address: {device.address}")
+        return device.address
+
+    async def _connect_known_device(self, timeout=3.0):
+        address = load_known_address()
+        if not address:
+            return None
+        client = BleakClient(address, timeout=timeout)
+        try:
+            await client.connect()
+        except Exception as e:
+            print(f"[DEBUG] Could not reconnect to known address {address}: {e}")
+            return None
+        self.connected_address = address
+        print(f"[DEBUG] Reconnected to known address {address} without scanning.")
+        return client
 
     def _parse_hr_data(self, data):
         flags = data[0]
@@ -47,31 +82,29 @@ class LiveHubController:
         rr_intervals = []
         if (flags & 0x10):
             rr_data_bytes = data[2:]
-            rr_intervals_raw = struct.unpack('<' + 'H' * (len(rr_data_bytes) // 2), rr_data_bytes)
-            rr_intervals = [int(interval / 1.024) for interval in rr_intervals_raw]
+            rr_intervals_raw = np.frombuffer(rr_data_bytes, dtype='<u2', count=len(rr_data_bytes) // 2)
+            rr_intervals = (rr_intervals_raw / 1.024).astype(np.int32).tolist()
         return {"hr_bpm": hr_bpm, "rr_intervals_ms": rr_intervals}
 
     def _notification_handler(self, sender, data):
-        asyncio.ensure_future(self.notification_queue.put(data))
+        # Bleak invokes this on the event loop thread, so only timestamp and hand off the packet.
+        # Checking session_active here keeps every accepted packet ahead of stop_session's flush.
+        if self.session_active:
+            self._pool.submit(self._process_data, bytes(data), time.perf_counter_ns(), datetime.utcnow())
 
     async def run(self):
         while True:
             try:
-                if not self.from_ui_q.empty():
+                while not self.from_ui_q.empty():
                     command = self.from_ui_q.get_nowait()
                     print(f"[DEBUG] Backend received command: {command}")
                     await self.command_handler.get(command['command'])(command)
 
-                if self.client and self.client.is_connected:
-                    data = await asyncio.wait_for(self.notification_queue.get(), timeout=0.1)
-                    self._process_data(data)
-                else:
-                    await asyncio.sleep(0.1)
+                # Notifications are handled by the BLE callback; just poll for UI commands
+                await asyncio.sleep(0.1)
             except asyncio.CancelledError:
                 print("[DEBUG] Controller task cancelled.")
                 break
-            except asyncio.TimeoutError:
-                pass
             except Exception as e:
                 print(f"[ERROR] An error occurred in the main loop: {e}")
                 await self.disconnect_device()
@@ -85,14 +118,18 @@ class LiveHubController:
         self.to_ui_q.put({'type': 'status', 'device': 'polar', 'status': 'scanning'})
         
         if not self.client or not self.client.is_connected:
-            self.connected_address = await self._find_polar_h10()
-            if not self.connected_address:
-                self.to_ui_q.put({'type': 'status', 'device': 'polar', 'status': 'disconnected'})
-                return
+            self.client = await self._connect_known_device()
+            if not self.client:
+                self.connected_address = await self._find_polar_h10()
+                if not self.connected_address:
+                    self.to_ui_q.put({'type': 'status', 'device': 'polar', 'status': 'disconnected'})
+                    return
             
             try:
-                self.client = BleakClient(self.connected_address)
-                await self.client.connect()
+                if not self.client:
+                    self.client = BleakClient(self.connected_address)
+                    await self.client.connect()
+                    save_known_address(self.connected_address)
                 
                 heart_rate_char = self.client.services.get_characteristic(HR_CHARACTERISTIC_UUID)
                 if not heart_rate_char:
@@ -109,7 +146,9 @@ class LiveHubController:
 
         self.session_active = True
         self.session_path = self.session_path_q.get()
-        self.data_log = []
+        with self._log_lock:
+            self._reset_log()
+            self.rows_written = 0
         self.to_ui_q.put({'type': 'status', 'backend': 'starting'})
         print(f"[DEBUG] Session started for subject {command['subject_id']}. Logging data.")
 
@@ -122,13 +161,9 @@ class LiveHubController:
         self.to_ui_q.put({'type': 'status', 'backend': 'stopped'})
         print("[DEBUG] Session stopped.")
         
-        if self.data_log and self.session_path:
-            print(f"[DEBUG] Saving {len(self.data_log)} data points...")
-            df = pd.DataFrame(self.data_log)
-            file_path = os.path.join(self.session_path, 'raw', 'polar_h10_raw.parquet')
-            pq.write_table(pa.Table.from_pandas(df), file_path)
-            print(f"[DEBUG] Data saved to {file_path}")
-            self.data_log = []
+        if self.session_path:
+            # Queued behind any packets the worker has not logged yet
+            await asyncio.get_running_loop().run_in_executor(self._pool, self._close_log)
             self.session_path = None
         
         await self.disconnect_device()
@@ -169,19 +204,59 @@ class LiveHubController:
                 'message': f"Error loading file: {e}"
             })
             
-    def _process_data(self, data):
+    def _reset_log(self):
+        """Starts an empty batch; the log is kept as one buffer per column."""
+        self.log_t_sys = array.array('q')
+        self.log_t_utc = []
+        self.log_hr = array.array('B')
+        self.log_rr = []
+        self.log_raw = []
+
+    def _flush_log(self):
+        """Writes buffered records to the session Parquet file as one batch."""
+        if not self.log_t_sys or not self.session_path:
+            return
+        if self.writer is None:
+            file_path = os.path.join(self.session_path, 'raw', 'polar_h10_raw.parquet')
+            self.writer = pq.ParquetWriter(file_path, self.schema, compression='zstd')
+        columns = [
+            pa.array(self.log_t_sys, pa.int64()),
+            pa.array(self.log_t_utc, pa.timestamp('us')),
+            pa.array(self.log_hr, pa.uint8()),
+            pa.array(self.log_rr, pa.list_(pa.uint16())),
+        ]
+        if self.keep_raw:
+            columns.append(pa.array(self.log_raw, pa.binary()))
+        self.writer.write_batch(pa.record_batch(columns, schema=self.schema))
+        self.rows_written += len(self.log_t_sys)
+        self._reset_log()
+
+    def _close_log(self):
+        """Writes any remaining records and closes the session Parquet file."""
+        with self._log_lock:
+            self._flush_log()
+            if self.writer:
+                self.writer.close()
+                self.writer = None
+                print(f"[DEBUG] Saved {self.rows_written} data points to {self.session_path}")
+            self._reset_log()
+
+    def _process_data(self, data, t_sys, t_utc):
         # This method is no longer for real-time plotting but for data logging during a session.
-        # It sends data to the UI but doesn't handle the plot.
-        t_sys = time.perf_counter()
-        t_utc = datetime.utcnow()
-        parsed_data = self._parse_hr_data(data)
-        
-        if self.session_active:
-            self.data_log.append({
-                "t_sys": t_sys,
-                "t_utc": t_utc.isoformat(),
-                "hr_bpm": parsed_data["hr_bpm"],
-                "rr_ms_list": parsed_data["rr_intervals_ms"],
-                "raw_hex": data.hex()
-            })
-            print(f"[LOG] Logged HR: {parsed_data['hr_bpm']} (Session Active)")
\ No newline at end of file
+        # It runs on the worker thread and doesn't handle the plot.
+        # Nothing reads the worker's futures, so errors must be reported here.
+        try:
+            parsed_data = self._parse_hr_data(data)
+            
+            with self._log_lock:
+                self.log_t_sys.append(t_sys)
+                self.log_t_utc.append(t_utc)
+                self.log_hr.append(parsed_data["hr_bpm"])
+                self.log_rr.append(parsed_data["rr_intervals_ms"])
+                if self.keep_raw:
+                    self.log_raw.append(data)
+                if len(self.log_t_sys) >= LOG_BATCH_SIZE:
+                    self._flush_log()
+            print(f"[LOG] Logged HR: {parsed_data['hr_bpm']} (Session Active)")
+        except Exception as e:
+            print(f"[ERROR] Failed to log HR packet {data.hex()}: {e}")
\ No newline at end of file
@@ -0,0 +1,20 @@
+import asyncio
+from bleak import BleakScanner
+
+async def find_device(device_name="Polar H10", timeout=5.0):
+    """
+    Scans until a device whose name contains device_name advertises and returns it.
+    Returns None if no such device is seen within timeout seconds.
+    Unlike BleakScanner.discover(), this stops as soon as the device is seen.
+    """
+    found = asyncio.get_running_loop().create_future()
+
+    def detection_callback(device, advertisement_data):
+        if device.name and device_name in device.name and not found.done():
+            found.set_result(device)
+
+    async with BleakScanner(detection_callback=detection_callback):
+        try:
+            return await asyncio.wait_for(found, timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
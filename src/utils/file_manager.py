@@ -2,14 +2,50 @@ import os
 import json
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+KNOWN_DEVICE_FILE = "data/known_device.json"
+SESSION_COUNTER_FILE = ".counter"
+
+def _scan_session_number(base_dir):
+    """
+    Returns the highest session number among the existing session folders, or 0.
+    """
+    highest = 0
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            prefix = entry.name.split('_', 1)[0]
+            if entry.is_dir() and prefix.startswith('S') and prefix[1:].isdigit():
+                highest = max(highest, int(prefix[1:]))
+    return highest
+
+def next_session_number(base_dir="data/sessions"):
+    """
+    Increments and returns the session counter kept in base_dir.
+    Falls back to scanning the session folders when there is no counter yet.
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    fd = os.open(os.path.join(base_dir, SESSION_COUNTER_FILE), os.O_RDWR | os.O_CREAT)
+    with os.fdopen(fd, 'r+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        current = f.read().strip()
+        session_num = int(current) + 1 if current.isdigit() else _scan_session_number(base_dir) + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(session_num))
+    return session_num
+
 def create_session_paths(subject_id, base_dir="data/sessions"):
     """
     Creates a new session folder and returns the full path.
     Example: data/sessions/S01_SUBJ001_YYYYMMDD/
     """
     date_str = datetime.now().strftime("%Y%m%d")
-    # A simple way to handle session number, could be more robust
-    session_num = len(os.listdir(base_dir)) + 1
+    session_num = next_session_number(base_dir)
     session_id = f"S{session_num:02d}_{subject_id}_{date_str}"
     session_path = os.path.join(base_dir, session_id)
     
@@ -28,4 +64,22 @@ def create_session_paths(subject_id, base_dir="data/sessions"):
     with open(os.path.join(session_path, 'meta', 'session_metadata.json'), 'w') as f:
         json.dump(meta, f, indent=4)
         
-    return session_path
\ No newline at end of file
+    return session_path
+
+def load_known_address(path=KNOWN_DEVICE_FILE):
+    """
+    Returns the address of the last connected device, or None if unknown.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f).get("address")
+    except (OSError, ValueError):
+        return None
+
+def save_known_address(address, path=KNOWN_DEVICE_FILE):
+    """
+    Remembers the device address so the next session can connect without scanning.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({"address": address}, f, indent=4)
@@ -0,0 +1,15 @@
+import numpy as np
+
+# A plot a few hundred pixels wide can't resolve more points than this
+MAX_PLOT_POINTS = 2000
+
+def decimate_series(values, max_points=MAX_PLOT_POINTS):
+    """
+    Returns (x, y) lists for a Dear PyGui line series, striding through
+    values so that at most max_points points are plotted.
+    x keeps the original sample index of each plotted point.
+    """
+    ys = np.asarray(values, dtype=np.float64)
+    stride = max(1, -(-len(ys) // max_points))
+    xs = np.arange(0, len(ys), stride, dtype=np.float64)
+    return xs.tolist(), ys[::stride].tolist()
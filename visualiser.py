@@ -2,7 +2,8 @@ import dearpygui.dearpygui as dpg
 import pandas as pd
 import os
 import numpy as np
-import ast
+import pyarrow.parquet as pq
+from src.utils.plot_utils import decimate_series
 
 def run_csv_visualiser():
     """Runs the Dear PyGui application for viewing CSV files."""
@@ -19,19 +20,22 @@ def run_csv_visualiser():
     
     # --- Data storage for plotting ---
     hr_data_to_plot = []
-    rr_data_to_plot = []
     
     def calculate_hrv_metrics(rr_intervals):
         """Calculates basic time-domain HRV metrics."""
         if len(rr_intervals) < 2:
             return {'rmssd': np.nan}
-        rr_diffs = np.diff(rr_intervals)
+        rr_diffs = np.diff(rr_intervals).astype(np.float64)
         rmssd = np.sqrt(np.mean(rr_diffs**2))
         return {'rmssd': rmssd}
 
+    def parse_rr_list(text):
+        """Parses a stringified RR list such as '[839 858]' or '[839, 858]'."""
+        return np.fromstring(text.strip('[]').replace(',', ' '), sep=' ', dtype=np.int32)
+
     def filter_rr_intervals(rr_intervals, min_ms=300, max_ms=2000):
         """Removes physiologically impossible RR intervals."""
-        return [rr for rr in rr_intervals if min_ms < rr < max_ms]
+        return rr_intervals[(rr_intervals > min_ms) & (rr_intervals < max_ms)]
 
     # --- Callbacks ---
     def file_selected_callback(sender, app_data):
@@ -44,47 +48,51 @@ def run_csv_visualiser():
             return
 
         try:
-            # Tell pandas to read the file with the default python engine which is more forgiving
-            df = pd.read_csv(file_path, engine='python')
+            is_parquet = file_path.lower().endswith('.parquet')
+            if is_parquet:
+                # Parquet keeps rr_ms_list as a native list column, no parsing needed.
+                # Only request columns the file has so the check below reports missing ones.
+                available = pq.read_schema(file_path).names
+                df = pd.read_parquet(file_path, columns=[c for c in ('hr_bpm', 'rr_ms_list') if c in available])
+            else:
+                # Tell pandas to read the file with the default python engine which is more forgiving
+                df = pd.read_csv(file_path, engine='python')
             
             if 'hr_bpm' not in df.columns or 'rr_ms_list' not in df.columns:
-                print("[ERROR] Required columns not found in the CSV file.")
+                print("[ERROR] Required columns not found in the file.")
                 dpg.set_value("status_text", "Error: 'hr_bpm' or 'rr_ms_list' column not found.")
                 return
 
-            # Now, safely evaluate the string representation of the lists
-            df['rr_ms_list'] = df['rr_ms_list'].apply(ast.literal_eval)
+            if not is_parquet:
+                # Convert the string representation of the lists back to arrays
+                df['rr_ms_list'] = df['rr_ms_list'].apply(parse_rr_list)
 
             # --- Update HR plot data ---
             current_hr_data = df['hr_bpm'].tolist()
             hr_data_to_plot.clear()
             hr_data_to_plot.extend(current_hr_data)
 
-            x_data_hr = list(range(len(hr_data_to_plot)))
-            dpg.set_value("hr_series_plot", [x_data_hr, hr_data_to_plot])
+            dpg.set_value("hr_series_plot", list(decimate_series(hr_data_to_plot)))
             
             if hr_data_to_plot:
                 dpg.set_axis_limits("x_axis_hr_plot", 0, len(hr_data_to_plot))
                 dpg.fit_axis_data("y_axis_hr_plot")
 
             # --- Update RR plot data ---
-            rr_intervals_flat = [interval for sublist in df['rr_ms_list'].tolist() for interval in sublist]
+            rr_lists = [np.asarray(rr, dtype=np.int32) for rr in df['rr_ms_list'].values]
+            rr_intervals_flat = np.concatenate(rr_lists) if rr_lists else np.empty(0, dtype=np.int32)
             
             # Filter the RR data for accurate RMSSD calculation
             filtered_rr_intervals = filter_rr_intervals(rr_intervals_flat)
             
-            rr_data_to_plot.clear()
-            rr_data_to_plot.extend(rr_intervals_flat)
-
-            x_data_rr = list(range(len(rr_data_to_plot)))
-            dpg.set_value("rr_series_plot", [x_data_rr, rr_data_to_plot])
+            dpg.set_value("rr_series_plot", list(decimate_series(rr_intervals_flat)))
 
-            if rr_data_to_plot:
-                dpg.set_axis_limits("x_axis_rr_plot", 0, len(rr_data_to_plot))
+            if rr_intervals_flat.size:
+                dpg.set_axis_limits("x_axis_rr_plot", 0, rr_intervals_flat.size)
                 dpg.fit_axis_data("y_axis_rr_plot")
             
             # --- Calculate and display metrics ---
-            if filtered_rr_intervals:
+            if filtered_rr_intervals.size:
                 metrics = calculate_hrv_metrics(filtered_rr_intervals)
                 dpg.set_value("rmssd_metric", f"RMSSD: {metrics['rmssd']:.2f} ms")
             else:
@@ -95,7 +103,7 @@ def run_csv_visualiser():
             print(f"[DEBUG] Plot and metrics updated with {len(hr_data_to_plot)} data points.")
 
         except Exception as e:
-            print(f"[ERROR] Failed to load or process CSV file: {e}")
+            print(f"[ERROR] Failed to load or process file: {e}")
             dpg.set_value("status_text", f"Error loading file: {e}")
 
     # --- File Dialog setup ---
@@ -107,13 +115,14 @@ def run_csv_visualiser():
         width=700, height=400
     ):
         dpg.add_file_extension(".csv", color=(255, 255, 0, 255))
+        dpg.add_file_extension(".parquet", color=(255, 255, 0, 255))
         dpg.add_file_extension(".*")
 
     # --- Main Window Layout ---
     main_window_tag = "csv_viewer_main_window"
     with dpg.window(label="CSV Heart Metrics Visualiser", tag=main_window_tag, width=900, height=1000):
-        dpg.add_text("Select a CSV file to visualize Heart Metrics.")
-        dpg.add_button(label="Browse for CSV File", callback=lambda: dpg.show_item("file_dialog_tag"))
+        dpg.add_text("Select a CSV or Parquet file to visualize Heart Metrics.")
+        dpg.add_button(label="Browse for CSV/Parquet File", callback=lambda: dpg.show_item("file_dialog_tag"))
         
         dpg.add_separator()
 